@@ -1,15 +1,20 @@
 import os
 import uvicorn
 import uuid
+import hashlib
 import httpx
+import aiohttp
+import redis.asyncio as aioredis
 import sys
 import json 
+import orjson
 import time 
 import asyncio
+import random
 from dotenv import load_dotenv
-from fastapi import FastAPI, Query, HTTPException
-from pydantic import BaseModel
-from typing import Dict, Any, List, Optional
+from fastapi import FastAPI, Query, HTTPException, Response, Header, Request
+from pydantic import BaseModel, ConfigDict, ValidationError, create_model
+from typing import Dict, Any, List, Optional, Union, Callable, Tuple, Awaitable, Literal
 from masumi.config import Config
 from masumi.payment import Payment 
 
@@ -31,10 +36,23 @@ NETWORK = os.getenv("NETWORK")
 PAYMENT_AMOUNT = int(os.getenv("PAYMENT_AMOUNT", "3000000"))
 PAYMENT_UNIT = os.getenv("PAYMENT_UNIT", "lovelace")
 
+# Masumi Payment Service Load Limits
+MASUMI_MAX_CONCURRENCY = int(os.getenv("MASUMI_MAX_CONCURRENCY", "16"))
+MASUMI_MAX_ATTEMPTS = int(os.getenv("MASUMI_MAX_ATTEMPTS", "3"))
+
+if MASUMI_MAX_CONCURRENCY < 1 or MASUMI_MAX_ATTEMPTS < 1:
+    logger.critical("MASUMI_MAX_CONCURRENCY and MASUMI_MAX_ATTEMPTS must be >= 1.")
+    sys.exit("Error: Invalid Masumi load limit configuration.")
+
 if not all([PAYMENT_SERVICE_URL, AGENT_IDENTIFIER, SELLER_VKEY, NETWORK]):
     logger.critical("Masumi core environment variables are not fully configured.")
     sys.exit("Error: Core Masumi configuration missing.")
 
+# Job Store Configuration (optional Redis; without it job state is per-process and in-memory)
+REDIS_URL = os.getenv("REDIS_URL")
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "86400"))
+KODOSUMI_RESULT_CACHE_TTL_SECONDS = int(os.getenv("KODOSUMI_RESULT_CACHE_TTL_SECONDS", "600")) # 0 disables reuse of results for identical inputs
+
 # Kodosumi Configuration
 KODOSUMI_BASE_URL = os.getenv("KODOSUMI_BASE_URL")
 KODOSUMI_USERNAME = os.getenv("KODOSUMI_USERNAME")
@@ -46,10 +64,13 @@ KODOSUMI_PRIMARY_FIELD_ID_FOR_PAYLOAD = os.getenv("KODOSUMI_PRIMARY_FIELD_ID_FOR
 # Kodosumi Polling Configuration
 KODOSUMI_POLL_INTERVAL_SECONDS = int(os.getenv("KODOSUMI_POLL_INTERVAL_SECONDS", "10"))
 KODOSUMI_POLL_TIMEOUT_SECONDS = int(os.getenv("KODOSUMI_POLL_TIMEOUT_SECONDS", "300")) 
+KODOSUMI_POLL_INITIAL_DELAY_SECONDS = float(os.getenv("KODOSUMI_POLL_INITIAL_DELAY_SECONDS", "0.5"))
+KODOSUMI_POLL_BACKOFF_FACTOR = float(os.getenv("KODOSUMI_POLL_BACKOFF_FACTOR", "1.5"))
+KODOSUMI_LONG_POLL_SECONDS = int(os.getenv("KODOSUMI_LONG_POLL_SECONDS", "0")) # 0 disables long-polling (?wait=N)
 _terminal_success_statuses_str = os.getenv("KODOSUMI_TERMINAL_SUCCESS_STATUSES", "finished,completed")
-KODOSUMI_TERMINAL_SUCCESS_STATUSES = [s.strip().lower() for s in _terminal_success_statuses_str.split(',')]
+KODOSUMI_TERMINAL_SUCCESS_STATUSES = frozenset(s.strip().lower() for s in _terminal_success_statuses_str.split(','))
 _terminal_error_statuses_str = os.getenv("KODOSUMI_TERMINAL_ERROR_STATUSES", "failed,error,cancelled,timeout")
-KODOSUMI_TERMINAL_ERROR_STATUSES = [s.strip().lower() for s in _terminal_error_statuses_str.split(',')]
+KODOSUMI_TERMINAL_ERROR_STATUSES = frozenset(s.strip().lower() for s in _terminal_error_statuses_str.split(','))
 
 
 if not all([KODOSUMI_BASE_URL, KODOSUMI_USERNAME, KODOSUMI_PASSWORD, KODOSUMI_FLOW_NAME_CONTAINS, KODOSUMI_PAYLOAD_INPUT_KEY, KODOSUMI_PRIMARY_FIELD_ID_FOR_PAYLOAD]):
@@ -68,6 +89,8 @@ if not any(field["id"] == KODOSUMI_PRIMARY_FIELD_ID_FOR_PAYLOAD for field in HAR
     logger.critical(f"Config Error: KODOSUMI_PRIMARY_FIELD_ID_FOR_PAYLOAD ('{KODOSUMI_PRIMARY_FIELD_ID_FOR_PAYLOAD}') not in HARDCODED_KODOSUMI_INPUT_FIELDS.")
     sys.exit("Error: Kodosumi primary field ID mismatch.")
 
+_PRIMARY_FIELD_REQUIRED = any(f["id"] == KODOSUMI_PRIMARY_FIELD_ID_FOR_PAYLOAD and f.get("is_required") for f in HARDCODED_KODOSUMI_INPUT_FIELDS)
+
 logger.info(f"Kodosumi-Masumi Wrapper initializing. Primary Kodosumi input: '{KODOSUMI_PRIMARY_FIELD_ID_FOR_PAYLOAD}', sent as key: '{KODOSUMI_PAYLOAD_INPUT_KEY}'. Polling interval: {KODOSUMI_POLL_INTERVAL_SECONDS}s, Timeout: {KODOSUMI_POLL_TIMEOUT_SECONDS}s.")
 
 app = FastAPI(
@@ -76,8 +99,32 @@ app = FastAPI(
     version="1.0.0"
 )
 
-jobs: Dict[str, Dict[str, Any]] = {}
-payment_instances: Dict[str, Payment] = {}
+jobs: Dict[str, Dict[str, Any]] = {} # Used only when REDIS_URL is not set
+payment_instances: Dict[str, Payment] = {} # Always per-process: the worker that created the payment monitors it
+redis_client: Optional[aioredis.Redis] = None
+
+def _job_key(job_id: str) -> str: return f"job:{job_id}"
+
+def _dumps_for_store(value: Any) -> Union[bytes, str]:
+    # orjson rejects integers beyond 64 bits, which purchasers can send in unvalidated input_data keys.
+    try: return orjson.dumps(value)
+    except TypeError: return json.dumps(value)
+
+async def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    if redis_client is None: return jobs.get(job_id)
+    raw = await redis_client.hgetall(_job_key(job_id))
+    # Stdlib json on read: orjson.loads turns integers beyond 64 bits into floats, which would silently change stored input_data.
+    return {k: json.loads(v) for k, v in raw.items()} if raw else None
+
+async def save_job(job_id: str, fields: Dict[str, Any]) -> None:
+    """Create or partially update a job. In Redis each field is JSON-encoded into the job's hash and the key TTL is refreshed."""
+    if redis_client is None:
+        jobs.setdefault(job_id, {}).update(fields); return
+    key = _job_key(job_id)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hset(key, mapping={k: _dumps_for_store(v) for k, v in fields.items()})
+        pipe.expire(key, JOB_TTL_SECONDS)
+        await pipe.execute()
 
 try:
     masumi_config = Config(payment_service_url=PAYMENT_SERVICE_URL, payment_api_key=PAYMENT_API_KEY)
@@ -85,50 +132,283 @@ except Exception as e:
     logger.critical(f"Failed to initialize Masumi Config: {str(e)}", exc_info=True)
     sys.exit("Error: Could not initialize Masumi Config.")
 
+# Bounds concurrent calls to the Masumi payment service so request bursts queue here instead of exhausting its pool.
+_masumi_sem = asyncio.Semaphore(MASUMI_MAX_CONCURRENCY)
+# Retry policies. No extra deadline is imposed on either call: the Masumi library's own HTTP timeout applies.
+# create_payment_request: only failures to establish the connection are retried; the request was never sent, so
+# Masumi cannot have acted on it. Anything later (read timeouts, resets) may follow a processed request, and
+# retrying could create a duplicate payment request.
+MASUMI_CREATE_RETRYABLE_ERRORS = (aiohttp.ClientConnectorError,)
+# complete_payment: targets an existing blockchainIdentifier, so resubmitting cannot create a new payment; timeouts
+# are retried too, since a lost result submission leaves the seller unpaid.
+MASUMI_COMPLETE_RETRYABLE_ERRORS = (aiohttp.ClientConnectorError, asyncio.TimeoutError)
+
+async def call_masumi(description: str, make_call: Callable[[], Awaitable[Any]], retry_on: Tuple[type, ...]) -> Any:
+    """Run a Masumi payment call under the concurrency limit, retrying retry_on errors with jittered exponential backoff."""
+    retry_delay = 0.5
+    for attempt in range(1, MASUMI_MAX_ATTEMPTS + 1):
+        try:
+            async with _masumi_sem:
+                return await make_call()
+        except retry_on as e:
+            if attempt >= MASUMI_MAX_ATTEMPTS: raise
+            sleep_for = retry_delay * (0.8 + 0.4 * random.random())
+            logger.warning(f"Masumi {description} failed (attempt {attempt}/{MASUMI_MAX_ATTEMPTS}): {str(e) or type(e).__name__}. Retrying in {sleep_for:.2f}s.")
+            await asyncio.sleep(sleep_for)
+            retry_delay *= 2
+
+_EXAMPLE_INPUT_DATA: Dict[str, Any] = {
+    f["id"]: f.get("data", {}).get("placeholder", True if f["type"] == "boolean" else (f.get("data",{}).get("values",[None])[0] if f["type"] == "option" else "sample"))
+    for f in HARDCODED_KODOSUMI_INPUT_FIELDS}
+
 class StartJobRequest(BaseModel):
     identifier_from_purchaser: str
     input_data: Dict[str, Any]
     class Config:
-        json_schema_extra = {"example": {"identifier_from_purchaser": "user_abc_124356", "input_data": {
-            f["id"]: f.get("data", {}).get("placeholder", True if f["type"] == "boolean" else (f.get("data",{}).get("values",[None])[0] if f["type"] == "option" else "sample"))
-            for f in HARDCODED_KODOSUMI_INPUT_FIELDS}}}
+        json_schema_extra = {"example": {"identifier_from_purchaser": "user_abc_124356", "input_data": _EXAMPLE_INPUT_DATA}}
 
 kodosumi_http_client: Optional[httpx.AsyncClient] = None
 @app.on_event("startup")
-async def startup_event(): global kodosumi_http_client; kodosumi_http_client = httpx.AsyncClient(timeout=60.0, follow_redirects=False) 
+async def startup_event():
+    global kodosumi_http_client, redis_client, _status_poller_task
+    if REDIS_URL:
+        redis_client = aioredis.from_url(REDIS_URL, decode_responses=True)
+        await redis_client.ping()
+        logger.info("Job store: Redis.")
+    else:
+        logger.info("Job store: in-memory (set REDIS_URL to share jobs across workers).")
+    # One pooled client for all Kodosumi traffic: keep-alive + HTTP/2 so login, trigger and polls reuse connections.
+    kodosumi_http_client = httpx.AsyncClient(
+        base_url=KODOSUMI_BASE_URL,
+        timeout=httpx.Timeout(60.0, connect=10.0),
+        limits=httpx.Limits(max_keepalive_connections=50, max_connections=200, keepalive_expiry=120.0),
+        http2=True,
+        follow_redirects=False,
+        headers={"User-Agent": "kodosumi-masumi/1.0"}
+    )
+    _status_poller_task = asyncio.create_task(_status_poller())
+    app.openapi() # Generate and cache the OpenAPI schema now rather than on the first /docs or /openapi.json hit
+    _schedule_kodosumi_warmup()
 @app.on_event("shutdown")
 async def shutdown_event(): 
+    if _status_poller_task: _status_poller_task.cancel()
     if kodosumi_http_client: await kodosumi_http_client.aclose()
+    if redis_client: await redis_client.aclose()
 
 class KodosumiError(Exception): pass
 
+# Kodosumi login token cache: one /login per TTL window instead of one per job.
+KODOSUMI_TOKEN_TTL_SECONDS = 600
+# The header dicts are built once per token and shared by all requests (httpx copies, never mutates, them).
+_auth_cache: Dict[str, Any] = {"token": None, "expires_at": 0.0, "headers": None, "trigger_headers": None}
+_auth_lock = asyncio.Lock()
+
+async def _get_kodosumi_token(force_refresh: bool = False, rejected_token: Optional[str] = None) -> str:
+    async with _auth_lock:
+        cached_token = _auth_cache["token"]
+        token_fresh = cached_token and time.monotonic() < _auth_cache["expires_at"]
+        # A forced refresh is skipped if another job already replaced the rejected token while we waited on the lock.
+        if token_fresh and (not force_refresh or (rejected_token and cached_token != rejected_token)):
+            return cached_token
+        login_params = {"name": KODOSUMI_USERNAME, "password": KODOSUMI_PASSWORD}
+        resp_login = await kodosumi_http_client.get("/login", params=login_params)
+        resp_login.raise_for_status(); token = orjson.loads(resp_login.content).get("KODOSUMI_API_KEY")
+        if not token: raise KodosumiError("Auth failed: KODOSUMI_API_KEY missing.")
+        _auth_cache.update({"token": token, "expires_at": time.monotonic() + KODOSUMI_TOKEN_TTL_SECONDS,
+                            "headers": {"kodosumi_api_key": token, "Accept": "application/json"},
+                            "trigger_headers": {"kodosumi_api_key": token, "Accept": "text/plain"}})
+        logger.info(f"Kodosumi login successful. Token cached for {KODOSUMI_TOKEN_TTL_SECONDS}s.")
+        return token
+
+async def _kodosumi_request(method: str, url: Union[str, httpx.URL], header_set: str = "headers", **kwargs) -> httpx.Response:
+    """Send an authenticated Kodosumi request with the cached header_set ("headers" or "trigger_headers"), re-authenticating once on 401."""
+    await _get_kodosumi_token()
+    headers = _auth_cache[header_set]
+    resp = await kodosumi_http_client.request(method, url, headers=headers, **kwargs)
+    if resp.status_code == 401:
+        logger.info(f"Kodosumi returned 401 for {method} {url}. Refreshing token and retrying once.")
+        await _get_kodosumi_token(force_refresh=True, rejected_token=headers["kodosumi_api_key"])
+        headers = _auth_cache[header_set]
+        resp = await kodosumi_http_client.request(method, url, headers=headers, **kwargs)
+    return resp
+
+# Kodosumi flow URL cache: the target flow rarely moves, so skip the /flow lookup while fresh.
+KODOSUMI_FLOW_URL_TTL_SECONDS = 300
+_flow_cache: Dict[str, Any] = {"url": None, "expires_at": 0.0}
+_flow_lock = asyncio.Lock()
+
+async def _get_flow_url(force_refresh: bool = False) -> str:
+    async with _flow_lock:
+        if not force_refresh and _flow_cache["url"] and time.monotonic() < _flow_cache["expires_at"]:
+            return _flow_cache["url"]
+        resp_flows = await _kodosumi_request("GET", "/flow")
+        resp_flows.raise_for_status(); flows_data = orjson.loads(resp_flows.content)
+        target_flow = next((f for f in flows_data.get("items", []) if isinstance(f, dict) and KODOSUMI_FLOW_NAME_CONTAINS.lower() in f.get("summary", "").lower()), None)
+        if not target_flow or not target_flow.get("url"): raise KodosumiError(f"Target Kodosumi flow '{KODOSUMI_FLOW_NAME_CONTAINS}' not found.")
+        _flow_cache.update({"url": target_flow["url"], "expires_at": time.monotonic() + KODOSUMI_FLOW_URL_TTL_SECONDS})
+        logger.info(f"Kodosumi flow '{KODOSUMI_FLOW_NAME_CONTAINS}' resolved to {target_flow['url']}. Cached for {KODOSUMI_FLOW_URL_TTL_SECONDS}s.")
+        return target_flow["url"]
+
+# Strong references to fire-and-forget tasks so they are not garbage-collected mid-flight.
+_background_tasks: set = set()
+
+async def _warm_kodosumi_caches():
+    """Resolve the login token and flow URL ahead of time so a confirmed job can go straight to the trigger POST."""
+    try:
+        await _get_flow_url()
+    except Exception as e:
+        logger.warning(f"Kodosumi cache warm-up failed (will retry on demand): {str(e)}")
+
+def _schedule_kodosumi_warmup():
+    task = asyncio.create_task(_warm_kodosumi_caches())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+def _kodosumi_timeout_error(status_url: httpx.URL) -> KodosumiError:
+    return KodosumiError(f"Kodosumi job polling timed out after {KODOSUMI_POLL_TIMEOUT_SECONDS} seconds for URL: {status_url}")
+
+def _is_kodosumi_job_finished(status_json: Dict[str, Any]) -> bool:
+    """True on a terminal success status, False while still running; raises KodosumiError on a terminal error status."""
+    kodosumi_status_value = status_json.get("status")
+    current_kodosumi_status = str(kodosumi_status_value).lower() if kodosumi_status_value is not None else ""
+    
+    logger.info(f"Kodosumi job status: '{current_kodosumi_status}'. Full response keys: {list(status_json.keys())}")
+
+    if current_kodosumi_status in KODOSUMI_TERMINAL_SUCCESS_STATUSES:
+        logger.info(f"Kodosumi job finished successfully with status '{current_kodosumi_status}'.")
+        return True
+    elif current_kodosumi_status in KODOSUMI_TERMINAL_ERROR_STATUSES:
+        error_detail = status_json.get("error", "No error details provided by Kodosumi.")
+        logger.error(f"Kodosumi job failed with status '{current_kodosumi_status}'. Details: {error_detail}")
+        raise KodosumiError(f"Kodosumi job failed with status '{current_kodosumi_status}'. Details: {str(error_detail)[:200]}")
+    return False
+
+# Shared status poller: one background task polls every active Kodosumi job and wakes its waiter through an
+# asyncio.Event, instead of each job running its own sleep/GET loop. Each job keeps its own jittered backoff
+# (KODOSUMI_POLL_INITIAL_DELAY_SECONDS growing to KODOSUMI_POLL_INTERVAL_SECONDS); due jobs are polled concurrently.
+_polled_jobs: Dict[str, Dict[str, Any]] = {}
+_poller_wakeup = asyncio.Event()
+_status_poller_task: Optional[asyncio.Task] = None
+
+def _next_poll_delay(poll_delay: float) -> float:
+    return min(poll_delay * KODOSUMI_POLL_BACKOFF_FACTOR, KODOSUMI_POLL_INTERVAL_SECONDS)
+
+def _jittered(delay: float) -> float:
+    return delay * (0.8 + 0.4 * random.random())
+
+async def _poll_registered_job(status_key: str, entry: Dict[str, Any]):
+    now = time.monotonic()
+    if now - entry["started_at"] > KODOSUMI_POLL_TIMEOUT_SECONDS:
+        entry["error"] = _kodosumi_timeout_error(entry["status_url"])
+    else:
+        try:
+            resp_status = await _kodosumi_request("GET", entry["status_url"])
+            resp_status.raise_for_status()
+            status_json = orjson.loads(resp_status.content)
+            if not _is_kodosumi_job_finished(status_json):
+                entry["due_at"] = time.monotonic() + _jittered(entry["poll_delay"])
+                entry["poll_delay"] = _next_poll_delay(entry["poll_delay"])
+                _poller_wakeup.set() # Let the poller reschedule around the new due time
+                return
+            entry["result"] = status_json
+        except Exception as e:
+            entry["error"] = e
+    _polled_jobs.pop(status_key, None)
+    entry["event"].set()
+
+async def _status_poller():
+    while True:
+        try:
+            _poller_wakeup.clear()
+            if not _polled_jobs:
+                await _poller_wakeup.wait()
+                continue
+            now = time.monotonic()
+            next_due_at = min(entry["due_at"] for entry in _polled_jobs.values())
+            if next_due_at == float("inf"):
+                # Every job has a poll in flight; wait for one to finish or for a new job to register.
+                await _poller_wakeup.wait()
+                continue
+            if next_due_at > now:
+                # Sleep until the next job is due, a new job registers, or an in-flight poll reschedules.
+                try: await asyncio.wait_for(_poller_wakeup.wait(), timeout=next_due_at - now)
+                except asyncio.TimeoutError: pass
+                continue
+            # Each due job is polled in its own task so one slow status endpoint cannot hold up the others.
+            for key, entry in _polled_jobs.items():
+                if entry["due_at"] <= now:
+                    entry["due_at"] = float("inf") # In flight; rescheduled by _poll_registered_job
+                    task = asyncio.create_task(_poll_registered_job(key, entry))
+                    _background_tasks.add(task)
+                    task.add_done_callback(_background_tasks.discard)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Kodosumi status poller iteration failed: {str(e)}", exc_info=True)
+            await asyncio.sleep(1)
+
+async def _await_kodosumi_job(status_url: httpx.URL, started_at: float) -> Dict[str, Any]:
+    if _status_poller_task is None or _status_poller_task.done():
+        raise KodosumiError("Kodosumi status poller is not running.")
+    status_key = str(status_url)
+    entry = _polled_jobs.get(status_key)
+    if entry is None:
+        entry = {"status_url": status_url, "event": asyncio.Event(), "result": None, "error": None, "started_at": started_at,
+                 "poll_delay": _next_poll_delay(KODOSUMI_POLL_INITIAL_DELAY_SECONDS), "due_at": time.monotonic() + _jittered(KODOSUMI_POLL_INITIAL_DELAY_SECONDS)}
+        _polled_jobs[status_key] = entry
+        _poller_wakeup.set()
+    await entry["event"].wait()
+    if entry["error"] is not None: raise entry["error"]
+    return entry["result"]
+
+async def _long_poll_kodosumi_job(status_url: httpx.URL, started_at: float) -> Optional[Dict[str, Any]]:
+    """Poll with ?wait=KODOSUMI_LONG_POLL_SECONDS. Returns None if Kodosumi rejects long-polling (400/501)."""
+    poll_delay = KODOSUMI_POLL_INITIAL_DELAY_SECONDS
+    while True:
+        if time.monotonic() - started_at > KODOSUMI_POLL_TIMEOUT_SECONDS:
+            raise _kodosumi_timeout_error(status_url)
+        request_started = time.monotonic()
+        try:
+            resp_status = await _kodosumi_request("GET", status_url, params={"wait": KODOSUMI_LONG_POLL_SECONDS},
+                                                  timeout=httpx.Timeout(KODOSUMI_LONG_POLL_SECONDS + 5, connect=10.0))
+        except httpx.ReadTimeout:
+            logger.info(f"Kodosumi long-poll held for {KODOSUMI_LONG_POLL_SECONDS}s without a response. Re-opening.")
+            continue
+        if resp_status.status_code in (400, 501):
+            logger.warning(f"Kodosumi rejected long-poll request (status {resp_status.status_code}). Falling back to interval polling.")
+            return None
+        resp_status.raise_for_status()
+        status_json = orjson.loads(resp_status.content)
+        if _is_kodosumi_job_finished(status_json): return status_json
+        if time.monotonic() - request_started >= KODOSUMI_LONG_POLL_SECONDS:
+            # Kodosumi held the request for the full window, so re-open right away; an early non-terminal answer still backs off.
+            continue
+        sleep_for = _jittered(poll_delay)
+        logger.info(f"Kodosumi long-poll returned early with a non-terminal status. Waiting {sleep_for:.2f}s before next poll.")
+        await asyncio.sleep(sleep_for)
+        poll_delay = _next_poll_delay(poll_delay)
+
 async def execute_kodosumi_flow_task(job_input_data: Dict[str, Any]) -> Dict[str, Any]:
     if not kodosumi_http_client: raise KodosumiError("Kodosumi HTTP client not initialized.")
     primary_input_value = job_input_data.get(KODOSUMI_PRIMARY_FIELD_ID_FOR_PAYLOAD)
     payload_val = str(primary_input_value) if not isinstance(primary_input_value, (str, int, float, bool)) else primary_input_value
-    if primary_input_value is None and any(f["id"] == KODOSUMI_PRIMARY_FIELD_ID_FOR_PAYLOAD and f.get("is_required") for f in HARDCODED_KODOSUMI_INPUT_FIELDS):
+    if primary_input_value is None and _PRIMARY_FIELD_REQUIRED:
         raise KodosumiError(f"Missing required primary input field '{KODOSUMI_PRIMARY_FIELD_ID_FOR_PAYLOAD}' for Kodosumi.")
     logger.info(f"Executing Kodosumi task. Field '{KODOSUMI_PRIMARY_FIELD_ID_FOR_PAYLOAD}' (value: '{str(payload_val)[:50]}...') as payload key '{KODOSUMI_PAYLOAD_INPUT_KEY}'.")
     
     kodosumi_job_status_url = None
     try:
-        # 1. Login
-        login_params = {"name": KODOSUMI_USERNAME, "password": KODOSUMI_PASSWORD}
-        resp_login = await kodosumi_http_client.get(f"{KODOSUMI_BASE_URL}/login", params=login_params)
-        resp_login.raise_for_status(); token1 = resp_login.json().get("KODOSUMI_API_KEY")
-        if not token1: raise KodosumiError("Auth failed: KODOSUMI_API_KEY missing.")
-        headers = {"kodosumi_api_key": token1}
-
-        # 2. Find Flow
-        resp_flows = await kodosumi_http_client.get(f"{KODOSUMI_BASE_URL}/flow", headers=headers)
-        resp_flows.raise_for_status(); flows_data = resp_flows.json()
-        target_flow = next((f for f in flows_data.get("items", []) if isinstance(f, dict) and KODOSUMI_FLOW_NAME_CONTAINS.lower() in f.get("summary", "").lower()), None)
-        if not target_flow or not target_flow.get("url"): raise KodosumiError(f"Target Kodosumi flow '{KODOSUMI_FLOW_NAME_CONTAINS}' not found.")
+        # 1. Login happens lazily in _kodosumi_request (cached token, refreshed on expiry or 401)
+        # 2. Find Flow (cached URL, re-discovered on expiry or if the trigger 404s)
+        flow_url = await _get_flow_url()
         
         # 3. Trigger Flow (POST)
         kodosumi_payload = {KODOSUMI_PAYLOAD_INPUT_KEY: payload_val}
-        trigger_headers = {**headers, "Accept": "text/plain"}
-        resp_trigger = await kodosumi_http_client.post(f"{KODOSUMI_BASE_URL}{target_flow['url']}", headers=trigger_headers, data=kodosumi_payload)
+        resp_trigger = await _kodosumi_request("POST", flow_url, header_set="trigger_headers", data=kodosumi_payload)
+        if resp_trigger.status_code == 404:
+            logger.info(f"Kodosumi flow trigger at cached URL {flow_url} returned 404. Re-discovering flow and retrying once.")
+            flow_url = await _get_flow_url(force_refresh=True)
+            resp_trigger = await _kodosumi_request("POST", flow_url, header_set="trigger_headers", data=kodosumi_payload)
 
         if resp_trigger.status_code >= 400:
             logger.error(f"Kodosumi flow trigger POST failed with status {resp_trigger.status_code}: {resp_trigger.text[:200]}")
@@ -141,7 +421,7 @@ async def execute_kodosumi_flow_task(job_input_data: Dict[str, Any]) -> Dict[str
             logger.info(f"Kodosumi flow trigger POST successful (status {resp_trigger.status_code}), Kodosumi job status URL: {kodosumi_job_status_url}")
         elif 200 <= resp_trigger.status_code < 300 and "application/json" in resp_trigger.headers.get("content-type", "").lower():
             logger.info(f"Kodosumi flow trigger POST successful (status {resp_trigger.status_code}) with direct JSON response (job might be very fast).")
-            direct_json_result = resp_trigger.json()
+            direct_json_result = orjson.loads(resp_trigger.content)
             kodosumi_status_val = direct_json_result.get("status") 
             kodosumi_status = str(kodosumi_status_val).lower() if kodosumi_status_val is not None else ""
 
@@ -155,65 +435,66 @@ async def execute_kodosumi_flow_task(job_input_data: Dict[str, Any]) -> Dict[str
             raise KodosumiError(f"Kodosumi flow trigger POST returned unexpected status {resp_trigger.status_code} and no redirect/JSON.")
 
         # 4. Poll Kodosumi Job Status URL
-        start_time = time.time()
-        while True:
-            if time.time() - start_time > KODOSUMI_POLL_TIMEOUT_SECONDS:
-                raise KodosumiError(f"Kodosumi job polling timed out after {KODOSUMI_POLL_TIMEOUT_SECONDS} seconds for URL: {kodosumi_job_status_url}")
-
-            logger.info(f"Polling Kodosumi job status at: {KODOSUMI_BASE_URL}{kodosumi_job_status_url}")
-            resp_status = await kodosumi_http_client.get(f"{KODOSUMI_BASE_URL}{kodosumi_job_status_url}", headers=headers)
-            resp_status.raise_for_status() 
-            
-            status_json = resp_status.json()
-            kodosumi_status_value = status_json.get("status")
-            current_kodosumi_status = str(kodosumi_status_value).lower() if kodosumi_status_value is not None else ""
-            
-            logger.info(f"Kodosumi job status: '{current_kodosumi_status}'. Full response keys: {list(status_json.keys())}")
-
-            if current_kodosumi_status in KODOSUMI_TERMINAL_SUCCESS_STATUSES:
-                logger.info(f"Kodosumi job finished successfully with status '{current_kodosumi_status}'.")
-                return status_json 
-            elif current_kodosumi_status in KODOSUMI_TERMINAL_ERROR_STATUSES:
-                error_detail = status_json.get("error", "No error details provided by Kodosumi.")
-                logger.error(f"Kodosumi job failed with status '{current_kodosumi_status}'. Details: {error_detail}")
-                raise KodosumiError(f"Kodosumi job failed with status '{current_kodosumi_status}'. Details: {str(error_detail)[:200]}")
-            
-            logger.info(f"Kodosumi job status is '{current_kodosumi_status}', not terminal. Waiting {KODOSUMI_POLL_INTERVAL_SECONDS}s before next poll.")
-            await asyncio.sleep(KODOSUMI_POLL_INTERVAL_SECONDS)
+        started_at = time.monotonic()
+        # Parsed once; the client joins it onto base_url for every poll.
+        status_url = httpx.URL(kodosumi_job_status_url)
+        logger.info(f"Polling Kodosumi job status at: {KODOSUMI_BASE_URL}{kodosumi_job_status_url}")
+        if KODOSUMI_LONG_POLL_SECONDS > 0:
+            long_poll_result = await _long_poll_kodosumi_job(status_url, started_at)
+            if long_poll_result is not None: return long_poll_result
+        return await _await_kodosumi_job(status_url, started_at)
 
     except httpx.HTTPStatusError as e: 
         raise KodosumiError(f"Kodosumi API HTTP error: {e.response.status_code} - {e.response.text[:200]}")
     except httpx.RequestError as e: raise KodosumiError(f"Kodosumi connection error: {str(e)}")
     except Exception as e: raise KodosumiError(f"Unexpected Kodosumi error: {str(e)}")
 
+# Input validation model built from HARDCODED_KODOSUMI_INPUT_FIELDS; strict so e.g. "3" is not accepted as a number.
+_INPUT_FIELD_TYPES: Dict[str, Any] = {"string": str, "number": float, "boolean": bool}
+
+def _input_field_type(field_def: Dict[str, Any]) -> Any:
+    # TODO: Implement detailed field_def["validations"] (min, max, format), e.g. as Annotated constraints on the returned type
+    if field_def["type"] == "option":
+        values = field_def.get("data", {}).get("values")
+        return Literal[tuple(values)] if values else str
+    return _INPUT_FIELD_TYPES.get(field_def["type"], Any)
+
+_InputModel = create_model(
+    "KodosumiInput",
+    __config__=ConfigDict(strict=True),
+    **{f["id"]: (_input_field_type(f), ... if f.get("is_required") else None) for f in HARDCODED_KODOSUMI_INPUT_FIELDS}
+)
+
+# Requests with bodies above this size have their input serialised and hashed in a worker thread, keeping the
+# event loop responsive; the canonical json.dumps dominates the cost, so both steps move together.
+INPUT_HASH_OFFLOAD_THRESHOLD_BYTES = 64 * 1024
+
+def _compute_input_hash(input_data: Dict[str, Any]) -> str:
+    # Kept on stdlib json: orjson emits raw UTF-8 and different float text, which would change the published input_hash.
+    input_bytes = json.dumps(input_data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(input_bytes).hexdigest()
+
 @app.post("/start_job")
-async def start_job(data: StartJobRequest):
+async def start_job(data: StartJobRequest, request: Request):
     job_id = str(uuid.uuid4())
     logger.info(f"Job {job_id}: /start_job from '{data.identifier_from_purchaser}'. Validating inputs: {list(data.input_data.keys())}")
-    for field_def in HARDCODED_KODOSUMI_INPUT_FIELDS:
-        fid, val = field_def["id"], data.input_data.get(field_def["id"])
-        if field_def.get("is_required") and fid not in data.input_data:
-            raise HTTPException(status_code=400, detail=f"Missing required field: '{fid}'.")
-        if fid in data.input_data: 
-            etype = field_def["type"]
-            mismatch = (etype == "string" and not isinstance(val, str)) or \
-                       (etype == "number" and not isinstance(val, (int, float))) or \
-                       (etype == "boolean" and not isinstance(val, bool)) or \
-                       (etype == "option" and (not isinstance(val, str) or ("values" in field_def.get("data",{}) and val not in field_def["data"]["values"])))
-            if mismatch: raise HTTPException(status_code=400, detail=f"Type/value error for '{fid}'. Expected {etype} compatible. Got {type(val).__name__} or invalid option.")
-            # TODO: Implement detailed field_def["validations"] (min, max, format)
+    try: _InputModel.model_validate(data.input_data)
+    except ValidationError as e: raise HTTPException(status_code=422, detail=e.errors(include_url=False))
 
     try:
-        import hashlib
-        input_json = json.dumps(data.input_data, sort_keys=True, separators=(',', ':'))
-        input_hash = hashlib.sha256(input_json.encode('utf-8')).hexdigest()
+        if int(request.headers.get("content-length") or 0) > INPUT_HASH_OFFLOAD_THRESHOLD_BYTES:
+            input_hash = await asyncio.to_thread(_compute_input_hash, data.input_data)
+        else:
+            input_hash = _compute_input_hash(data.input_data)
         logger.info(f"Job {job_id}: Calculated input_hash: {input_hash}")
 
         payment = Payment(agent_identifier=AGENT_IDENTIFIER, config=masumi_config, 
                           identifier_from_purchaser=data.identifier_from_purchaser,
                           input_data=data.input_data, network=NETWORK) 
         
-        payment_req_data = await payment.create_payment_request()
+        # Warm Kodosumi auth/flow caches while the Masumi payment is created and confirmed.
+        _schedule_kodosumi_warmup()
+        payment_req_data = await call_masumi("create_payment_request", payment.create_payment_request, MASUMI_CREATE_RETRYABLE_ERRORS)
         if not payment_req_data or payment_req_data.get("status") != "success" or "data" not in payment_req_data:
             raise HTTPException(status_code=500, detail=f"Masumi payment request failed: {str(payment_req_data)[:200]}")
 
@@ -221,16 +502,16 @@ async def start_job(data: StartJobRequest):
         payment_id = masumi_details["blockchainIdentifier"] 
         logger.info(f"Job {job_id}: Masumi payment request created. Payment ID: {payment_id}")
 
-        jobs[job_id] = {"status": "awaiting_payment", "payment_status": "pending", "masumi_payment_id": payment_id, 
+        await save_job(job_id, {"status": "awaiting_payment", "payment_status": "pending", "masumi_payment_id": payment_id, 
                         "input_data": data.input_data, "result": None, "error": None, 
                         "message": "Awaiting payment confirmation.", "identifier_from_purchaser": data.identifier_from_purchaser,
-                        "input_hash_calculated": input_hash}
+                        "input_hash_calculated": input_hash})
 
         async def masumi_library_event_callback(event_payment_id_from_masumi: str):
             logger.info(f"Job {job_id}: Masumi callback received. Event for Masumi payment_id: '{event_payment_id_from_masumi}'. This job expects: '{payment_id}'.")
             if event_payment_id_from_masumi == payment_id:
                 logger.info(f"Job {job_id}: Matched event_payment_id '{event_payment_id_from_masumi}'. Proceeding to handle payment confirmation.")
-                current_job_state = jobs.get(job_id)
+                current_job_state = await get_job(job_id)
                 if current_job_state and current_job_state["status"] == "awaiting_payment":
                      await handle_payment_confirmation(job_id, payment_id) 
                 elif current_job_state:
@@ -270,47 +551,143 @@ async def start_job(data: StartJobRequest):
         logger.error(f"Job {job_id}: Error in /start_job for '{data.identifier_from_purchaser}': {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
 
+# Identical inputs (same input_hash) share one Kodosumi run: concurrent jobs await the in-flight run,
+# and later ones reuse its result while it is still in the result cache.
+_inflight_kodosumi_runs: Dict[str, asyncio.Future] = {}
+_result_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {} # Used only when REDIS_URL is not set
+
+def _result_key(input_hash: str) -> str: return f"result:{input_hash}"
+
+async def _get_cached_result(input_hash: str) -> Optional[Dict[str, Any]]:
+    if KODOSUMI_RESULT_CACHE_TTL_SECONDS <= 0: return None
+    if redis_client is not None:
+        raw = await redis_client.get(_result_key(input_hash))
+        return orjson.loads(raw) if raw else None
+    cached = _result_cache.get(input_hash)
+    if cached and time.monotonic() < cached[0]: return cached[1]
+    _result_cache.pop(input_hash, None)
+    return None
+
+async def _cache_result(input_hash: str, result: Dict[str, Any]) -> None:
+    if KODOSUMI_RESULT_CACHE_TTL_SECONDS <= 0: return
+    if redis_client is not None:
+        await redis_client.set(_result_key(input_hash), _dumps_for_store(result), ex=KODOSUMI_RESULT_CACHE_TTL_SECONDS)
+        return
+    now = time.monotonic()
+    for stale_hash in [h for h, (expires_at, _) in _result_cache.items() if expires_at <= now]: del _result_cache[stale_hash]
+    _result_cache[input_hash] = (now + KODOSUMI_RESULT_CACHE_TTL_SECONDS, result)
+
+async def run_kodosumi_flow_deduplicated(job_id: str, input_hash: str, job_input_data: Dict[str, Any]) -> Dict[str, Any]:
+    try: cached_result = await _get_cached_result(input_hash)
+    except Exception as e_c:
+        logger.error(f"Job {job_id}: Failed reading Kodosumi result cache for input_hash {input_hash}: {str(e_c)}", exc_info=True)
+        cached_result = None
+    if cached_result is not None:
+        logger.info(f"Job {job_id}: Reusing cached Kodosumi result for input_hash {input_hash}.")
+        return cached_result
+    inflight = _inflight_kodosumi_runs.get(input_hash)
+    if inflight is not None:
+        logger.info(f"Job {job_id}: Identical Kodosumi run already in flight for input_hash {input_hash}. Awaiting its result.")
+        return await asyncio.shield(inflight)
+
+    run_future = asyncio.get_running_loop().create_future()
+    # Mark the exception as retrieved so an unawaited failure doesn't log "Future exception was never retrieved".
+    run_future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    _inflight_kodosumi_runs[input_hash] = run_future
+    try:
+        result = await execute_kodosumi_flow_task(job_input_data)
+    except asyncio.CancelledError:
+        _inflight_kodosumi_runs.pop(input_hash, None)
+        # Waiters get a KodosumiError rather than CancelledError so their jobs fail through the normal path.
+        run_future.set_exception(KodosumiError("In-flight Kodosumi run was cancelled."))
+        raise
+    except Exception as e:
+        _inflight_kodosumi_runs.pop(input_hash, None)
+        run_future.set_exception(e)
+        raise
+    # Resolve waiters first; the resolved future stays registered until the result is cached, so no duplicate run starts in between.
+    run_future.set_result(result)
+    # The run already succeeded (and was paid for); a failing cache write must not turn it into a failed job.
+    try: await _cache_result(input_hash, result)
+    except Exception as e_c: logger.error(f"Job {job_id}: Failed caching Kodosumi result for input_hash {input_hash}: {str(e_c)}", exc_info=True)
+    finally: _inflight_kodosumi_runs.pop(input_hash, None)
+    return result
+
+def _extract_result_string(job_id: str, kodosumi_full_result: Dict[str, Any]) -> Optional[str]:
+    """Pull the purchaser-facing result string (final.CrewOutput.raw) out of a Kodosumi result object."""
+    extracted_string_result = None
+    try:
+        # Attempt to extract the raw string as per user's example
+        extracted_string_result = kodosumi_full_result.get("final", {}).get("CrewOutput", {}).get("raw")
+        if not isinstance(extracted_string_result, str):
+            logger.warning(f"Job {job_id}: Extracted 'raw' result is not a string, it's {type(extracted_string_result)}. Full Kodosumi result: {str(kodosumi_full_result)[:500]}")
+            # Fallback or decide how to handle if not a string. For now, setting to None if not string.
+            if extracted_string_result is not None: # If it's not None but also not a string
+                 extracted_string_result = str(extracted_string_result) # Convert to string as a fallback
+            else: # If it's None
+                extracted_string_result = None # Keep it None
+    except Exception as e:
+        logger.error(f"Job {job_id}: Error extracting 'raw' string from Kodosumi result: {str(e)}. Full Kodosumi result: {str(kodosumi_full_result)[:500]}", exc_info=True)
+        extracted_string_result = None # Or an error message string
+    return extracted_string_result
+
 async def handle_payment_confirmation(job_id: str, masumi_payment_id: str):
-    job_info = jobs.get(job_id)
+    job_info = await get_job(job_id)
     if not job_info or job_info.get("status") != "awaiting_payment":
         logger.warning(f"Job {job_id}: handle_payment_confirmation for '{masumi_payment_id}' skipped or already processed. Status: {job_info.get('status') if job_info else 'N/A'}.")
         return
     logger.info(f"Job {job_id}: Payment '{masumi_payment_id}' confirmed. Processing Kodosumi task.")
-    job_info.update({"status": "running", "payment_status": "confirmed", "processed_payment_id": masumi_payment_id, "message": "Payment confirmed, Kodosumi task is now running (polling for completion)."})
+    await save_job(job_id, {"status": "running", "payment_status": "confirmed", "processed_payment_id": masumi_payment_id, "message": "Payment confirmed, Kodosumi task is now running (polling for completion)."})
+    final_status = "running"
     try:
-        kodosumi_result_obj = await execute_kodosumi_flow_task(job_info["input_data"]) 
+        kodosumi_result_obj = await run_kodosumi_flow_deduplicated(job_id, job_info["input_hash_calculated"], job_info["input_data"]) 
         logger.info(f"Job {job_id}: Kodosumi task completed and result object received.")
         
-        # Store the full Kodosumi result object internally for now
-        job_info["kodosumi_full_result"] = kodosumi_result_obj 
+        # Only the extracted string /status serves is kept on the job; the full object is dropped after Masumi completion
+        result_string = _extract_result_string(job_id, kodosumi_result_obj)
+        result_digest = hashlib.sha256(result_string.encode('utf-8')).hexdigest() if result_string is not None else None
+        await save_job(job_id, {"result_string": result_string, "result_digest": result_digest})
 
         if job_id in payment_instances:
-            try: await payment_instances[job_id].complete_payment(masumi_payment_id, kodosumi_result_obj) # Pass full obj to Masumi
+            try: await call_masumi("complete_payment", lambda: payment_instances[job_id].complete_payment(masumi_payment_id, kodosumi_result_obj), MASUMI_COMPLETE_RETRYABLE_ERRORS) # Pass full obj to Masumi
             except Exception as e_mc: logger.error(f"Job {job_id}: Failed marking Masumi payment {masumi_payment_id} complete: {e_mc}", exc_info=True)
         
-        job_info.update({"status": "completed", "payment_status": "completed", 
-                         # "result" will be formatted by /status endpoint
-                         "error": None, "message": "Task completed successfully."})
+        final_status = "completed"
+        await save_job(job_id, {"status": "completed", "payment_status": "completed", 
+                                "error": None, "message": "Task completed successfully."})
     except KodosumiError as e_k:
         logger.error(f"Job {job_id}: Kodosumi task processing failed: {str(e_k)}") 
-        job_info.update({"status": "failed", "error": f"Kodosumi error: {str(e_k)}", "payment_status": "confirmed_kodosumi_failed", "message": f"Task failed: {str(e_k)}"})
+        final_status = "failed"
+        await save_job(job_id, {"status": "failed", "error": f"Kodosumi error: {str(e_k)}", "payment_status": "confirmed_kodosumi_failed", "message": f"Task failed: {str(e_k)}"})
     except Exception as e_g: 
         logger.error(f"Job {job_id}: Unexpected error during Kodosumi task execution or Masumi completion: {str(e_g)}", exc_info=True)
-        job_info.update({"status": "failed", "error": f"Task execution error: {str(e_g)}", "message": "Task failed unexpectedly."})
+        final_status = "failed"
+        await save_job(job_id, {"status": "failed", "error": f"Task execution error: {str(e_g)}", "message": "Task failed unexpectedly."})
     finally:
-        if job_id in payment_instances and job_info.get("status") in ["completed", "failed", "payment_failed"]:
-            logger.info(f"Job {job_id}: Stopping Masumi monitoring. Final status: {job_info['status']}.")
+        if job_id in payment_instances and final_status in ["completed", "failed", "payment_failed"]:
+            logger.info(f"Job {job_id}: Stopping Masumi monitoring. Final status: {final_status}.")
             try: payment_instances[job_id].stop_status_monitoring()
             except Exception as e_sm: logger.error(f"Job {job_id}: Error stopping Masumi monitoring: {e_sm}", exc_info=True)
 
+def _status_etag(jd: Dict[str, Any]) -> str:
+    # Built from small fields only; the (possibly large) result is represented by the digest stored alongside it.
+    return 'W/"' + hashlib.sha1(orjson.dumps([jd["status"], jd.get("message"), jd.get("error"), jd.get("result_digest")])).hexdigest() + '"'
+
 @app.get("/status")
-async def get_status_endpoint(job_id: str = Query(..., description="Job ID to check.")):
+async def get_status_endpoint(response: Response, job_id: str = Query(..., description="Job ID to check."),
+                              if_none_match: Optional[str] = Header(None)):
     logger.info(f"Received /status request for job_id: {job_id}")
-    if job_id not in jobs: 
+    jd = await get_job(job_id)
+    if jd is None: 
         logger.warning(f"Job {job_id} not found for /status request.")
         raise HTTPException(status_code=404, detail="Job not found")
-    
-    jd = jobs[job_id]
+
+    etag = _status_etag(jd)
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+        logger.debug(f"Job {job_id}: /status unchanged (ETag match), returning 304.")
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
     
     response_payload = {
         "job_id": job_id,
@@ -319,24 +696,8 @@ async def get_status_endpoint(job_id: str = Query(..., description="Job ID to ch
     }
 
     # Add "result" field if job is completed and result is available
-    if jd["status"] == "completed" and "kodosumi_full_result" in jd:
-        kodosumi_full_result = jd.get("kodosumi_full_result")
-        extracted_string_result = None
-        try:
-            # Attempt to extract the raw string as per user's example
-            extracted_string_result = kodosumi_full_result.get("final", {}).get("CrewOutput", {}).get("raw")
-            if not isinstance(extracted_string_result, str):
-                logger.warning(f"Job {job_id}: Extracted 'raw' result is not a string, it's {type(extracted_string_result)}. Full Kodosumi result: {str(kodosumi_full_result)[:500]}")
-                # Fallback or decide how to handle if not a string. For now, setting to None if not string.
-                if extracted_string_result is not None: # If it's not None but also not a string
-                     extracted_string_result = str(extracted_string_result) # Convert to string as a fallback
-                else: # If it's None
-                    extracted_string_result = None # Keep it None
-        except Exception as e:
-            logger.error(f"Job {job_id}: Error extracting 'raw' string from Kodosumi result: {str(e)}. Full Kodosumi result: {str(kodosumi_full_result)[:500]}", exc_info=True)
-            extracted_string_result = None # Or an error message string
-        
-        response_payload["result"] = extracted_string_result
+    if jd["status"] == "completed" and "result_string" in jd:
+        response_payload["result"] = jd["result_string"]
     elif "error" in jd and jd["error"]: # If job failed, message might contain error. Result is typically null.
         response_payload["result"] = None
 
@@ -353,17 +714,16 @@ async def get_status_endpoint(job_id: str = Query(..., description="Job ID to ch
 # Uncomment if you want to use the /provide_input endpoint.
 #@app.post("/provide_input")
 #async def provide_input(job_id: str, input_data: Dict[str, Any]):
-#    if job_id not in jobs: raise HTTPException(status_code=404, detail="Job not found")
+#    if await get_job(job_id) is None: raise HTTPException(status_code=404, detail="Job not found")
 #    logger.warning(f"/provide_input is stub for job {job_id}.")
 #    return {"status": "success", "message": "Input received (stub endpoint)."}
 
-@app.get("/availability")
-async def check_availability():
-    #return {"status": "available", "agentidentifier": AGENT_IDENTIFIER, "message": "Server operational."}
-    return {"type": "masumi-agent"}
-@app.get("/input_schema")
-async def input_schema():
-    logger.info("Received /input_schema request.")
+# /availability and /input_schema bodies are constant for the process lifetime: build them once.
+# Only /input_schema may be cached by clients/proxies; /availability must reach the service so a down agent is noticed.
+STATIC_RESPONSE_CACHE_CONTROL = "public, max-age=300"
+_AVAILABILITY_RESPONSE = {"type": "masumi-agent"}
+
+def _build_input_schema_response() -> Dict[str, Any]:
     output_fields = []
     for field in HARDCODED_KODOSUMI_INPUT_FIELDS:
         transformed = {"id": field["id"], "type": field["type"]}
@@ -376,6 +736,19 @@ async def input_schema():
         output_fields.append(transformed)
     return {"input_data": output_fields}
 
+_INPUT_SCHEMA_RESPONSE = _build_input_schema_response()
+
+@app.get("/availability")
+async def check_availability(response: Response):
+    #return {"status": "available", "agentidentifier": AGENT_IDENTIFIER, "message": "Server operational."}
+    response.headers["Cache-Control"] = "no-cache"
+    return _AVAILABILITY_RESPONSE
+@app.get("/input_schema")
+async def input_schema(response: Response):
+    logger.info("Received /input_schema request.")
+    response.headers["Cache-Control"] = STATIC_RESPONSE_CACHE_CONTROL
+    return _INPUT_SCHEMA_RESPONSE
+
 @app.get("/health")
 async def health(): return {"status": "healthy", "message": "Service operational."}
 
@@ -384,4 +757,14 @@ if __name__ == "__main__":
                 KODOSUMI_PASSWORD, KODOSUMI_FLOW_NAME_CONTAINS, KODOSUMI_PAYLOAD_INPUT_KEY, KODOSUMI_PRIMARY_FIELD_ID_FOR_PAYLOAD]):
         logger.critical("CRITICAL: Essential environment variables missing. Server cannot start.")
         sys.exit(1)
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level=os.getenv("LOG_LEVEL", "info").lower())
\ No newline at end of file
+    # Single worker by default: jobs are only shared across workers through Redis, and logging_config's
+    # RotatingFileHandler on logs/app.log is not safe to roll over from several processes.
+    workers = int(os.getenv("UVICORN_WORKERS", "1"))
+    if workers > 1 and not REDIS_URL:
+        logger.warning(f"UVICORN_WORKERS={workers} without REDIS_URL: jobs are in-memory per worker and /status may miss them.")
+    if workers > 1:
+        logger.warning(f"UVICORN_WORKERS={workers}: all workers share logs/app.log; rollover across processes can lose or interleave lines.")
+    # The import string is only needed to spawn workers; with one worker, serve this module's app instead of re-importing it.
+    uvicorn.run("main:app" if workers > 1 else app, host="0.0.0.0", port=8000, workers=workers,
+                loop="uvloop" if sys.platform != "win32" else "asyncio", http="httptools",
+                log_level=os.getenv("LOG_LEVEL", "info").lower(), lifespan="on")
\ No newline at end of file